@@ -1,12 +1,16 @@
-#! /usr/bin/env python
+#! /usr/bin/env python3
 
 """A Freecell solver"""
 
 import argparse
 import csv
+from functools import lru_cache
 import logging
+import multiprocessing
+import sys
+from types import MappingProxyType
 
-from search import Problem, astar, dfs
+from search import NoSolutionError, Problem, astar
 
 _MAX_RANK = 13
 _MAX_COLS = 8
@@ -15,10 +19,22 @@ _DECK_SIZE = 52
 _SUIT_LST = ('D', 'H', 'C', 'S')
 _RANK_LST = (None, 'A', '2', '3', '4', '5', '6', '7', '8', '9', 'T', 'J', 'Q', 'K')
 
+# A card is packed into 6 bits as (rank << 2) | suit. A column is an integer
+# used as a stack of cards, with the playable card in the lowest 6 bits. The
+# home cells are packed into one integer with the rank for suit i in bits 8*i
+# through 8*i+7.
+_CARD_BITS = 6
+_CARD_MASK = (1 << _CARD_BITS) - 1
+_HOME_BITS = 8
+_HOME_MASK = (1 << _HOME_BITS) - 1
+_GOAL_HOME = sum(_MAX_RANK << (suit * _HOME_BITS) for suit in range(4))
+
 
 class Card(object):
     """Represents a card."""
 
+    __slots__ = ('rank_str', 'rank_int', 'suit_str', 'suit_int', '_str', 'is_red', 'type', 'next_type', 'tup', 'id')
+
     _rank_map = {rank_str: rank_int for rank_int, rank_str in enumerate(_RANK_LST) if rank_str is not None}
 
     def __init__(self, rank, suit):
@@ -33,11 +49,12 @@ class Card(object):
         self.rank_int = rank
         self.suit_str = _SUIT_LST[suit]
         self.suit_int = suit
-        self._str = '%s%s' % (self.rank_str, self.suit_str)
-        self.is_red = is_red(self.suit_str)
+        self._str = self.rank_str + self.suit_str
+        self.is_red = _is_red_int(suit)
         self.type = (rank, self.is_red)
         self.next_type = (rank - 1, not self.is_red) if rank > 1 else None # Next card type in tableau
         self.tup = (rank, suit)
+        self.id = (rank << 2) | suit
 
     def __str__(self):
         return self._str
@@ -52,16 +69,118 @@ class Card(object):
         return cls._rank_map[rank_str]
 
 
+# Lookup tables indexed by packed card. A card's type is its rank and color,
+# packed as (rank << 1) | is_black. _NEEDED_TYPE is the type of card that can
+# be put on top of the card in the tableau (None for an Ace).
+_IS_RED = tuple(suit >> 1 == 0 for suit in range(4))
+_CARD_STR = tuple(
+    _RANK_LST[card >> 2] + _SUIT_LST[card & 3] if card >> 2 else None
+    for card in range((_MAX_RANK + 1) << 2)
+)
+_CARD_TYPE = tuple(card >> 1 for card in range((_MAX_RANK + 1) << 2))
+_NUM_TYPES = (_MAX_RANK + 1) << 1
+_NEEDED_TYPE = tuple(
+    ((card >> 1) - 2) ^ 1 if card >> 2 > 1 else None
+    for card in range((_MAX_RANK + 1) << 2)
+)
+
+# Suit color tables indexed by suit
+_OPP_COLOR = tuple( # _OPP_COLOR[i] is the suits opposite in color from i
+    tuple(other for other in range(4) if _IS_RED[other] != _IS_RED[suit]) for suit in range(4)
+)
+_SIBLING_SUIT = tuple( # _SIBLING_SUIT[i] is the other suit of the same color as i
+    [other for other in range(4) if other != suit and _IS_RED[other] == _IS_RED[suit]][0]
+    for suit in range(4)
+)
+
+
+def _auto_home(card):
+    """Return the least home cells, lane by lane, that let this card go home
+    automatically (see FreeCellProblem._automatic_cards).
+
+    :param card: a card
+    :type card: int
+
+    The card's own lane is 0; whether the card is next for its home cell is
+    checked separately.
+    """
+    rank = card >> 2
+    suit = card & 3
+    rtn = 0
+    if rank > 2:
+        for opp_color_suit in _OPP_COLOR[suit]:
+            rtn |= (rank - 1) << (opp_color_suit * _HOME_BITS)
+        if rank > 3:
+            rtn |= (rank - 2) << (_SIBLING_SUIT[suit] * _HOME_BITS)
+    return rtn
+
+
+# Home cells are compared lane by lane against _AUTO_HOME[card]: with the top
+# bit of every lane set, a lane's top bit survives the subtraction exactly
+# when that lane is at least the required rank.
+_LANE_HIGH = sum(1 << (suit * _HOME_BITS + _HOME_BITS - 1) for suit in range(4))
+_AUTO_HOME = tuple(_auto_home(card) for card in range((_MAX_RANK + 1) << 2))
+
+
+def _auto_dependents(card):
+    """Return the cards that may be able to go home automatically once this
+    card is home.
+
+    :param card: a card
+    :type card: int
+
+    These are the next card of the same suit, the next cards of the opposite
+    color, and the card two ranks up of the other suit of the same color.
+    """
+    rank = card >> 2
+    suit = card & 3
+    rtn = []
+    if rank < _MAX_RANK:
+        for other in (suit,) + _OPP_COLOR[suit]:
+            rtn.append(((rank + 1) << 2) | other)
+    if rank + 2 <= _MAX_RANK:
+        rtn.append(((rank + 2) << 2) | _SIBLING_SUIT[suit])
+    return tuple(rtn)
+
+
+_AUTO_DEPENDENTS = tuple(_auto_dependents(card) for card in range((_MAX_RANK + 1) << 2))
+
+
+def _home_rank(home, suit):
+    """Return the rank of the card on the home cell for this suit.
+
+    :param home: the home cells
+    :type home: int
+    :param suit: a suit
+    :type suit: int
+    """
+    return (home >> (suit * _HOME_BITS)) & _HOME_MASK
+
+
+_is_red_int = _IS_RED.__getitem__ # Return whether or not this suit (an int) is red
+_is_red_str = frozenset(('D', 'H')).__contains__ # Return whether or not this suit (a string) is red
+
+
 def is_red(suit):
     """Return whether or not this suit is red.
 
     :param suit: a suit
     :type suit: string or int
+
+    Callers that know the type of the suit should use _is_red_int or
+    _is_red_str instead.
     """
     if isinstance(suit, str):
-        return suit in ('D', 'H')
+        return _is_red_str(suit)
     else:
-        return _SUIT_LST[suit] in ('D', 'H')
+        return _is_red_int(suit)
+
+
+# Maps a card string (such as '3H') to its packed card
+_DECK = MappingProxyType({
+    str(card): card.id
+    for card in (Card(rank, suit) for suit in range(4) for rank in range(1, _MAX_RANK + 1))
+})
 
 
 class FreeCellProblem(Problem):
@@ -69,85 +188,58 @@ class FreeCellProblem(Problem):
 
     Description of a state:
 
-    Each card is 2-character string.
+    Each card is an integer packed as (rank << 2) | suit.
 
-    Each column is a string containing the concatenated cards. The last two
-    characters are the playable card.
+    Each column is an integer containing the stacked cards, 6 bits per card.
+    The lowest 6 bits are the playable card.
 
     The state is a tuple:
 
-    0: Rank of card on home cell for suit 0
-    1: Rank of card on home cell for suit 1
-    2: Rank of card on home cell for suit 2
-    3: Rank of card on home cell for suit 3
-    4: Set of free cells
-    5: Set of columns (tableau)
+    0: Home cells as an integer; the rank for suit i is in bits 8*i to 8*i+7
+    1: Sorted tuple of the cards in the free cells
+    2: Sorted tuple of the columns (tableau)
     """
 
+    __slots__ = ('_init_state',)
+
     def __init__(self, filename):
         """Initialize from this board layout.
 
         :param filename: the name of the csv file
         :type filename: string
         """
-        self._cards = self._deck() # Use this to get precomputed Card objects.
-
-        # Get each card's next card in rank
-        self._next_in_rank = {}
-        for card in self._cards.itervalues():
-            if card.rank_int != _MAX_RANK:
-                new_rank = card.rank_int + 1
-                suit = card.suit_int
-                self._next_in_rank[card] = self._cards[(new_rank, suit)]
-
-        # Suit color
-        self._is_red = [is_red(suit) for suit in _SUIT_LST]
-        self._opp_color = [] # self._opp_color[i] is the set of suits opposite in color from i
-        self._sibling_suit = [] # self._sibling_suit[i] is the other suit of the same color as i
-        for suit in xrange(4):
-            is_red_ = self._is_red[suit]
-            opp_colors = set()
-            for other_suit in xrange(4):
-                if self._is_red[other_suit] != is_red_:
-                    opp_colors.add(other_suit)
-                elif other_suit != suit:
-                    self._sibling_suit.append(other_suit)
-            self._opp_color.append(opp_colors)
-
-        deck = set(str(card) for card in self._cards.itervalues())
+        cards = self._deck()
+        deck = set(cards)
         tableau = set()
         with open(filename) as file_obj:
             for row in csv.reader(file_obj):
                 # Ignore commented rows
                 if not row or not row[0] or row[0].isspace() or row[0][0] == '#':
                     continue
-                column = ''
+                column = 0
                 for card in row:
                     card = card.upper()
+                    if card not in deck:
+                        if card in cards:
+                            raise ValueError('Duplicate card: %s' % card)
+                        raise ValueError('Invalid card: %s' % card)
                     deck.remove(card)
-                    column += card
+                    column = (column << _CARD_BITS) | cards[card]
                 tableau.add(column)
 
         if len(deck) > 0:
             raise ValueError('Missing cards: %s' % deck)
 
-        self._init_state = (0, 0, 0, 0, frozenset(), frozenset(tableau))
+        self._init_state = (0, (), tuple(sorted(tableau)))
 
     @staticmethod
     def _deck():
         """Return a deck of cards.
 
-        More specifically, return a dictionary mapping a string (such as '3H')
-        and its corresponding (rank, suit) tuple (for '3H', this is (3, 1))
-        to its Card.
+        More specifically, return a read-only mapping of a string (such as '3H')
+        to its packed card. The deck is built once and shared.
         """
-        rtn = {}
-        for suit_ndx in xrange(4):
-            for rank_ndx in xrange(1, _MAX_RANK+1):
-                card = Card(rank_ndx, suit_ndx)
-                rtn[str(card)] = card
-                rtn[card.tup] = card
-        return rtn
+        return _DECK
 
     def initial_state(self):
         """Return the initial state."""
@@ -155,226 +247,178 @@ class FreeCellProblem(Problem):
 
     def is_goal(self, state):
         """Return whether or not this is the goal."""
-        for suit in xrange(4):
-            if state[suit] != _MAX_RANK:
-                return False
-        return True
+        return state[0] == _GOAL_HOME
 
     @staticmethod
     def _remove_card_from_col(tableau, col):
         """Remove a card from the column.
 
-        :param tableau: the set of columns
-        :type tableau: frozenset or set
+        :param tableau: the columns (sorted tuple)
+        :type tableau: tuple
         :param col: the column
-        :type col: string
+        :type col: int
 
-        This returns the modified tableau. 
-        i.e.
-            If tableau is a frozenset, this will return a new set.
-            If tableau is a set, this will return it.
+        This returns the tableau as a new sorted tuple.
         """
-        if isinstance(tableau, frozenset):
-            tableau = set(tableau)
-        tableau.remove(col)
-        col = col[:-2]
-        if col:
-            tableau.add(col)
-        return tableau
+        rest = col >> _CARD_BITS
+        cols = list(tableau)
+        cols.remove(col)
+        if rest:
+            cols.append(rest)
+            cols.sort()
+        return tuple(cols)
 
     @staticmethod
     def _add_card_to_col(tableau, col, card):
         """Add a card to a column.
 
-        :param tableau: the set of columns
-        :type tableau: set or frozenset
+        :param tableau: the columns (sorted tuple)
+        :type tableau: tuple
         :param col: a column
-        :type col: string
+        :type col: int
         :param card: a card
-        :type card: Card
+        :type card: int
 
-        This returns the modified tableau. 
-        i.e.
-            If tableau is a frozenset, this will return a new set.
-            If tableau is a set, this will return it.
+        This returns the tableau as a new sorted tuple.
         """
-        if isinstance(tableau, frozenset):
-            tableau = set(tableau)
-        tableau.remove(col)
-        col += str(card)
-        tableau.add(col)
-        return tableau
+        cols = list(tableau)
+        cols.remove(col)
+        cols.append((col << _CARD_BITS) | card)
+        cols.sort()
+        return tuple(cols)
 
     @staticmethod
     def _add_card_to_new_col(tableau, card):
         """Put this card in a new column.
 
-        :param tableau: the set of columns
-        :type tableau: frozenset or set
+        :param tableau: the columns (sorted tuple)
+        :type tableau: tuple
         :param card: a card
-        :type card: Card
+        :type card: int
 
-        This returns the modified tableau. 
-        i.e.
-            If tableau is a frozenset, this will return a new set.
-            If tableau is a set, this will return it.
+        This returns the tableau as a new sorted tuple.
         """
-        if isinstance(tableau, frozenset):
-            tableau = set(tableau)
-        tableau.add(str(card))
-        return tableau
+        return tuple(sorted(tableau + (card,)))
 
     @staticmethod
     def _add_card_to_free(freecells, card):
         """Add this card to a free cell.
 
-        :param freecells: the free cells (set of strings)
-        :type freecells: frozenset
+        :param freecells: the free cells (sorted tuple of cards)
+        :type freecells: tuple
         :param card: a card
-        :type card: Card
+        :type card: int
 
-        This returns freecells as a new frozenset.
+        This returns freecells as a new sorted tuple.
         """
-        freecells = set(freecells)
-        freecells.add(str(card))
-        return frozenset(freecells)
+        return tuple(sorted(freecells + (card,)))
 
     @staticmethod
     def _remove_card_from_free(freecells, card):
         """Remove this card from the free cells.
 
-        :param freecells: the free cells (set of strings)
-        :type freecells: frozenset
+        :param freecells: the free cells (sorted tuple of cards)
+        :type freecells: tuple
         :param card: a card
-        :type card: Card
+        :type card: int
 
-        This returns freecells as a new frozenset.
+        This returns freecells as a new sorted tuple.
         """
-        freecells = set(freecells)
-        freecells.remove(str(card))
-        return frozenset(freecells)
+        ndx = freecells.index(card)
+        return freecells[:ndx] + freecells[ndx+1:]
 
     @staticmethod
-    def _to_home(state, needed_home, card):
-        """Return a tuple of the 4 home cells as a result of adding this card to home.
+    def _to_home(state, card):
+        """Return the home cells as a result of adding this card to home.
         If the card cannot be added, return None.
 
-        :param needed_home: a set of Cards needed
-        :type needed_home: set
         :param card: a card
-        :type card: Card
+        :type card: int
         """
-        if card in needed_home:
-            rtn = list(state[:4])
-            rtn[card.suit_int] = card.rank_int
-            return tuple(rtn)
+        shift = (card & 3) * _HOME_BITS
+        if (state[0] >> shift) & _HOME_MASK == (card >> 2) - 1:
+            return state[0] + (1 << shift)
         else:
             return None
 
     @staticmethod
     def _remove_from_home(state, card):
-        """Return a tuple of the 4 home cells as a result of removing this card.
+        """Return the home cells as a result of removing this card.
 
         :param card: a card
-        :type card: Card
+        :type card: int
         """
-        home = list(state[:4])
-        home[card.suit_int] -= 1
-        return tuple(home)
+        return state[0] - (1 << ((card & 3) * _HOME_BITS))
 
     def _to_tab(self, tab, needed_tab, card):
-        """Return a list of tableaus resulting from putting this card in the tableau
+        """Generate the tableaus resulting from putting this card in the tableau
         from outside the tableau.
 
         :param tab: a tableau
-        :type tab: frozenset
-        :param needed_tab: maps a (rank, is_red) tuple (card that's needed) to a list of columns
-        :type needed_tab: dict
+        :type tab: tuple
+        :param needed_tab: maps a card type (card that's needed) to a tuple of columns
+        :type needed_tab: list
         :param card: a card
-        :type card: Card
+        :type card: int
 
-        The new tableaus will be frozensets.
+        The new tableaus will be sorted tuples.
         """
-        rtn = []
         if len(tab) < _MAX_COLS:
-            rtn.append(frozenset(self._add_card_to_new_col(tab, card)))
-        for col in needed_tab.get(card.type, []):
-            rtn.append(frozenset(self._add_card_to_col(tab, col, card)))
-        return rtn
+            yield self._add_card_to_new_col(tab, card)
+        for col in needed_tab[_CARD_TYPE[card]]:
+            yield self._add_card_to_col(tab, col, card)
 
-    def _within_tab(self, tab, needed_tab, av_tab):
-        """Return a list of tableaus resulting from moving a card within the tableau.
+    def _within_tab(self, tab, needed_tab, av_tab, tab_without=None):
+        """Generate the tableaus resulting from moving a card within the tableau.
 
         :param tab: a tableau
-        :type tab: frozenset
-        :param needed_tab: maps a (rank, is_red) tuple (card that's needed) to a list of columns
-        :type needed_tab: dict
-        :param av_tab: maps a Card to its column
+        :type tab: tuple
+        :param needed_tab: maps a card type (card that's needed) to a tuple of columns
+        :type needed_tab: list
+        :param av_tab: maps a card to its column
         :type av_tab: dict
+        :param tab_without: maps a column to the tableau without that column's
+            playable card; this is filled in for the columns a card is moved from
+        :type tab_without: dict
 
-        The new tableaus will be frozensets.
+        The new tableaus will be sorted tuples.
         """
-        rtn = []
-        for av_card, from_col in av_tab.iteritems():
-            if len(from_col) > 2 and len(tab) < _MAX_COLS:
-                new_tab = self._remove_card_from_col(tab, from_col)
-                new_tab = self._add_card_to_new_col(new_tab, av_card)
-                rtn.append(frozenset(new_tab))
-            for to_col in needed_tab.get(av_card.type, []):
-                new_tab = self._remove_card_from_col(tab, from_col)
-                new_tab = self._add_card_to_col(new_tab, to_col, av_card)
-                rtn.append(frozenset(new_tab))
-        return rtn
+        if tab_without is None:
+            tab_without = {}
+        remove_card_from_col = self._remove_card_from_col
+        add_card_to_col = self._add_card_to_col
+        tab_has_room = len(tab) < _MAX_COLS
+        for av_card, from_col in av_tab.items():
+            to_new_col = tab_has_room and from_col > _CARD_MASK
+            to_cols = needed_tab[_CARD_TYPE[av_card]]
+            if not to_new_col and not to_cols:
+                continue
+            new_tab = tab_without[from_col] = remove_card_from_col(tab, from_col)
+            if to_new_col:
+                yield self._add_card_to_new_col(new_tab, av_card)
+            for to_col in to_cols:
+                yield add_card_to_col(new_tab, to_col, av_card)
 
     @staticmethod
-    def _new_state(state, home=None, free=None, tab=None):
-        """Return a new state with some modifications.
-
-        If any of the options are not None, they will appear in the new state. Otherwise,
-        whatever's in "state" will appear in the new state.
-        
-        :param home: the home cells
-        :type home: tuple
-        :param free: the free cells
-        :type free: frozenset
-        :param tab: the tableau
-        :type tab: frozenset
-        """
-        if home is None:
-            home = state[:4]
-        if free is None:
-            free = state[4]
-        if tab is None:
-            tab = state[5]
-        return home + (free, tab)
-
-    def _av_home(self, state):
-        """Return the set of available home cells."""
-        rtn = set()
-        for suit_ndx in xrange(4):
-            rank = state[suit_ndx]
+    def _av_home(state):
+        """Return a list of the cards on top of the home cells."""
+        rtn = []
+        for suit in range(4):
+            rank = _home_rank(state[0], suit)
             if rank > 0:
-                rtn.add(self._cards[(rank, suit_ndx)])
+                rtn.append((rank << 2) | suit)
         return rtn
 
-    def _needed_home(self, state):
-        """Return the set of needed cards to go home."""
-        rtn = set()
-        for suit in xrange(4):
-            rank = state[suit]
-            if rank < _MAX_RANK:
-                rtn.add(self._cards[(rank+1, suit)])
-        return rtn
-
-    def _av_tab(self, tab):
+    @staticmethod
+    def _av_tab(tab):
         """Return the available cards in the tableau.
 
         :param tab: the tableau
-        :type tab: frozenset
+        :type tab: tuple
 
-        More specifically, this returns a dictionary mapping a Card to its column.
+        More specifically, this returns a dictionary mapping a card to its column.
         """
-        return {self._cards[col[-2:]]: col for col in tab}
+        return {col & _CARD_MASK: col for col in tab}
 
     @staticmethod
     def _needed_tab(av_tab):
@@ -383,25 +427,23 @@ class FreeCellProblem(Problem):
         :param av_tab: the available cards in the tableau (from self._av_tab)
         :type av_tab: dict
 
-        More specifically, return a dictionary mapping a (rank, is_red) tuple to a list of columns.
+        More specifically, return a list indexed by card type, where each entry
+        is a tuple of the columns needing that type.
         """
-        rtn = {}
-        for card, col in av_tab.iteritems():
-            if card.rank_int > 1:
-                needed = card.next_type
-                if needed in rtn:
-                    rtn[needed].append(col)
-                else:
-                    rtn[needed] = [col]
+        rtn = [()] * _NUM_TYPES
+        for card, col in av_tab.items():
+            needed = _NEEDED_TYPE[card]
+            if needed is not None:
+                rtn[needed] += (col,)
         return rtn
 
-    def _automatic_cards(self, state, cards):
+    def _automatic_cards(self, home, cards):
         """Return a new set of cards that can be moved home automatically.
 
-        :param state: a tuple or list where the first four elements are the ranks of the home cells
-        :type state: tuple or list
-        :param cards: Cards to test
-        :type cards: set
+        :param home: the home cells
+        :type home: int
+        :param cards: cards to test
+        :type cards: iterable
 
         A card can be automatically moved to its home cell if one of the following is true:
         - the card is an Ace
@@ -414,52 +456,36 @@ class FreeCellProblem(Problem):
 
         Idea taken from http://www.idiotsdelight.net/freecell-help.html
 
-        Assume these cards can be moved home.
+        Cards that aren't next for their home cell are skipped.
         """
         rtn = set()
+        high_home = home | _LANE_HIGH
         for card in cards:
-            rank = card.rank_int
-            if rank <= 2:
+            if (home >> ((card & 3) * _HOME_BITS)) & _HOME_MASK != (card >> 2) - 1:
+                continue # Not the next card for its home cell
+            if (high_home - _AUTO_HOME[card]) & _LANE_HIGH == _LANE_HIGH:
                 rtn.add(card)
-            else:
-                prev_rank = rank - 1 # Could be precomputed
-                opp_suits_home = True
-                suit = card.suit_int
-                for opp_color_suit in self._opp_color[suit]:
-                    if state[opp_color_suit] < prev_rank:
-                        opp_suits_home = False
-                        break
-                if opp_suits_home and (rank == 3 or state[self._sibling_suit[suit]] >= rank - 2):
-                    # rank-2 could be precomputed 
-                    rtn.add(card)
-
         return rtn
 
-    def _move_home(self, card, needed_home, home):
-        """Move this card home.
+    @staticmethod
+    def _move_home(card, home):
+        """Move this card home and return the new home cells.
 
         :param card: a card
-        :type card: Card
-        :param needed_home: Cards needed home
-        :type needed_home: set
+        :type card: int
         :param home: the home cells
-        :type home: list
+        :type home: int
 
         Assume the card can be moved home.
         """
-        home[card.suit_int] += 1
-        needed_home.remove(card)
-        if card.rank_int < _MAX_RANK:
-            needed_home.add(self._next_in_rank[card])
+        return home + (1 << ((card & 3) * _HOME_BITS))
 
-    def _auto_neighbor(self, state, needed_home, free, av_tab):
+    def _auto_neighbor(self, state, free, av_tab):
         """Return the automatic neighbor and its cost.
 
-        :param needed_home: Cards needed home
-        :type needed_home: set
-        :param free: free cell Cards
+        :param free: free cell cards
         :type free: set
-        :param av_tab: maps a Card to its column
+        :param av_tab: maps a card to its column
         :type av_tab: dict
 
         For this, keep moving cards to their home cells. If none can be moved,
@@ -476,103 +502,111 @@ class FreeCellProblem(Problem):
 
         Idea taken from http://www.idiotsdelight.net/freecell-help.html
 
-        This may modify needed_home, free, and av_tab if there are moves.
+        This may modify free and av_tab if there are moves.
+
+        Only the cards a move could have freed up are tested again: those in
+        _AUTO_DEPENDENTS of the card moved home, and the card it uncovers.
         """
         cost = 0
-        home = list(state[:4])
-        tab = state[5]
+        home = state[0]
+        tab = state[2]
 
+        candidates = set(free)
+        candidates.update(av_tab)
         while True:
-            delta_cost = 0
-            # From free
-            for card in self._automatic_cards(home, free & needed_home):
-                free.remove(card)
-                self._move_home(card, needed_home, home)
-                delta_cost += 1
-
-            # From tab
-            for card in self._automatic_cards(home, set(av_tab) & needed_home):
-                self._move_home(card, needed_home, home)
-                col = av_tab[card]
-                del av_tab[card]
-                tab = self._remove_card_from_col(tab, col)
-                if len(col) > 2:
-                    av_tab[self._cards[col[-4:-2]]] = col[:-2]
-                delta_cost += 1
-
-            if delta_cost == 0:
-                if cost == 0:
-                    return None
-                return self._new_state(
-                    state, home=tuple(home), free=frozenset(str(card) for card in free), 
-                    tab=frozenset(tab)
-                ), cost
-
-            cost += delta_cost
+            ready = self._automatic_cards(home, candidates)
+            if not ready:
+                break
+            candidates = set()
+            for card in ready:
+                home = self._move_home(card, home)
+                cost += 1
+                if card in free:
+                    free.remove(card)
+                else:
+                    col = av_tab.pop(card)
+                    tab = self._remove_card_from_col(tab, col)
+                    col >>= _CARD_BITS
+                    if col:
+                        av_tab[col & _CARD_MASK] = col
+                        candidates.add(col & _CARD_MASK)
+                for dependent in _AUTO_DEPENDENTS[card]:
+                    if dependent in free or dependent in av_tab:
+                        candidates.add(dependent)
+
+        if cost == 0:
+            return None
+        return (home, tuple(sorted(free)), tab), cost
 
     def neighbors(self, state):
-        """Return a list of states that can be reached from this state."""
+        """Generate the (state, cost) tuples that can be reached from this state."""
         # Automatic move
-        needed_home = self._needed_home(state)
-        free = {self._cards[card] for card in state[4]}
-        av_tab = self._av_tab(state[5])
-        auto_neighbor = self._auto_neighbor(state, needed_home, free, av_tab)
+        free = set(state[1])
+        av_tab = self._av_tab(state[2])
+        auto_neighbor = self._auto_neighbor(state, free, av_tab)
         if auto_neighbor is not None:
-            return [auto_neighbor]
+            yield auto_neighbor
+            return
 
         av_home = self._av_home(state)
         needed_tab = self._needed_tab(av_tab)
 
-        rtn = [] # List of states only
+        # Local names for the helpers used in the loops below
+        to_tab = self._to_tab
+        to_home = self._to_home
+        remove_card_from_col = self._remove_card_from_col
+
+        home, free_cells, tab = state
+        free_has_room = len(free_cells) < _MAX_FREE_CELLS
 
         ### From free
         for card in free:
             new_free = None
             # To tab
-            new_tabs = self._to_tab(state[5], needed_tab, card)
-            if new_tabs:
-                new_free = self._remove_card_from_free(state[4], card)
-                for new_tab in new_tabs:
-                    rtn.append(self._new_state(state, free=new_free, tab=new_tab))
+            for new_tab in to_tab(tab, needed_tab, card):
+                if new_free is None:
+                    new_free = self._remove_card_from_free(free_cells, card)
+                yield (home, new_free, new_tab), 1
 
             # To home
-            new_home = self._to_home(state, needed_home, card)
+            new_home = to_home(state, card)
             if new_home is not None:
                 if new_free is None:
-                    new_free = self._remove_card_from_free(state[4], card)
-                rtn.append(self._new_state(state, home=new_home, free=new_free))
+                    new_free = self._remove_card_from_free(free_cells, card)
+                yield (new_home, new_free, tab), 1
 
         ### From tab
         # To tab
-        for new_tab in self._within_tab(state[5], needed_tab, av_tab):
-            rtn.append(self._new_state(state, tab=new_tab))
-        # To free
-        if len(state[4]) < _MAX_FREE_CELLS:
-            for card, col in av_tab.iteritems():
-                new_free = self._add_card_to_free(state[4], card)
-                new_tab = frozenset(self._remove_card_from_col(state[5], col))
-                rtn.append(self._new_state(state, free=new_free, tab=new_tab))
-        # To home
-        for card, col in av_tab.iteritems():
-            new_home = self._to_home(state, needed_home, card)
+        tab_without = {} # Tableaus with a column's playable card taken off
+        for new_tab in self._within_tab(tab, needed_tab, av_tab, tab_without):
+            yield (home, free_cells, new_tab), 1
+        # To free and to home (both leave the same tableau behind)
+        add_card_to_free = self._add_card_to_free
+        for card, col in av_tab.items():
+            new_home = to_home(state, card)
+            if new_home is None and not free_has_room:
+                continue
+            new_tab = tab_without.get(col)
+            if new_tab is None:
+                new_tab = remove_card_from_col(tab, col)
+            if free_has_room:
+                new_free = add_card_to_free(free_cells, card)
+                yield (home, new_free, new_tab), 1
             if new_home is not None:
-                new_tab = frozenset(self._remove_card_from_col(state[5], col))
-                rtn.append(self._new_state(state, home=new_home, tab=new_tab))
+                yield (new_home, free_cells, new_tab), 1
 
         ### From home
         for card in av_home:
             new_home = None
             # To free
-            if len(state[4]) < _MAX_FREE_CELLS:
-                new_free = self._add_card_to_free(state[4], card)
+            if free_has_room:
+                new_free = add_card_to_free(free_cells, card)
                 new_home = self._remove_from_home(state, card)
-                rtn.append(self._new_state(state, home=new_home, free=new_free))
+                yield (new_home, new_free, tab), 1
             # To tab
-            for new_tab in self._to_tab(state[5], needed_tab, card):
+            for new_tab in to_tab(tab, needed_tab, card):
                 new_home = self._remove_from_home(state, card) if new_home is None else new_home
-                rtn.append(self._new_state(state, home=new_home, tab=new_tab))
-
-        return [(new_state, 1) for new_state in rtn] # Place holder for now
+                yield (new_home, free_cells, new_tab), 1
 
     def move_description(self, from_state, to_state):
         """Return a string describing the transition between the two states.
@@ -580,16 +614,18 @@ class FreeCellProblem(Problem):
         e.g. 'Move 3H home'.
         """
         ## Check free cells
-        added_free_cells = to_state[4] - from_state[4]
+        added_free_cells = set(to_state[1]).difference(from_state[1])
         if added_free_cells:
             for card in added_free_cells:
-                return 'Move %s to a free cell.' % card
+                return 'Move %s to a free cell.' % _CARD_STR[card]
 
         ## Check home cells
         to_home_cards = []
-        for suit_int in xrange(4):
-            for rank_int in xrange(from_state[suit_int]+1, to_state[suit_int]+1):
-                to_home_cards.append(str(self._cards[(rank_int, suit_int)]))
+        for suit_int in range(4):
+            from_rank = _home_rank(from_state[0], suit_int)
+            to_rank = _home_rank(to_state[0], suit_int)
+            for rank_int in range(from_rank+1, to_rank+1):
+                to_home_cards.append(_CARD_STR[(rank_int << 2) | suit_int])
         if to_home_cards:
             if len(to_home_cards) == 1:
                 return 'Move %s to its home cell.' % to_home_cards[0]
@@ -599,72 +635,173 @@ class FreeCellProblem(Problem):
                 return 'Move %s, and %s to their home cells.' % (', '.join(to_home_cards[:-1]), to_home_cards[-1])
 
         ## Check tableau
-        to_tab = to_state[5]
-        from_tab =  from_state[5]
+        # Only the columns that changed matter: the column a card was added to
+        # and, for a move within the tableau, the column it came from.
+        added_cols = set(to_state[2]).difference(from_state[2])
+        removed_cols = set(from_state[2]).difference(to_state[2])
         # Check for a card added to an existing column
-        for to_col in to_tab:
-            if to_col[:-2] in from_tab:
-                return 'Move %s on top of %s.' % (to_col[-2:], to_col[-4:-2])
-        # Check for a card added to a new column
-        for to_col in to_tab:
-            if len(to_col) == 2 and to_col not in from_tab:
-                return 'Move %s to a new column.' % to_col
+        for to_col in added_cols:
+            if to_col >> _CARD_BITS in removed_cols:
+                return 'Move %s on top of %s.' % (
+                    _CARD_STR[to_col & _CARD_MASK], _CARD_STR[(to_col >> _CARD_BITS) & _CARD_MASK]
+                )
+        # Check for a card added to a new column. A single card left behind in
+        # the column the card came from is not a new column.
+        shrunk_cols = {from_col >> _CARD_BITS for from_col in removed_cols}
+        for to_col in added_cols:
+            if to_col <= _CARD_MASK and to_col not in shrunk_cols:
+                return 'Move %s to a new column.' % _CARD_STR[to_col]
 
         raise ValueError('Unable to find the right move')
 
     def display(self, state):
         """Display this state in a nice way."""
+        lines = []
+
         # First row
         gap = 4 # Number of spaces between free and home cells
         row = '|'
-        for card in sorted(state[4]):
+        for card in sorted(_CARD_STR[card] for card in state[1]):
             row += card + '|'
-        for _ in range(4 - len(state[4])):
+        for _ in range(4 - len(state[1])):
             row += '  |'
         row += ' ' * gap + '|'
-        for ndx in xrange(4):
-            home_rank = state[ndx]
+        for ndx in range(4):
+            home_rank = _home_rank(state[0], ndx)
             if home_rank == 0:
                 row += '  '
             else:
-                row += str(self._cards[(home_rank, ndx)])
+                row += _CARD_STR[(home_rank << 2) | ndx]
             row += '|'
-        print row
+        lines.append(row)
 
         # Second row
-        print '+--+--+--+--+' + '-' * gap + '+--+--+--+--+'
+        lines.append('+--+--+--+--+' + '-' * gap + '+--+--+--+--+')
 
         # Tableau
-        max_len = max(len(col) for col in state[5]) / 2
-        for ndx in xrange(max_len):
+        cols = []
+        for col in state[2]:
+            cards = []
+            while col:
+                cards.append(_CARD_STR[col & _CARD_MASK])
+                col >>= _CARD_BITS
+            cards.reverse()
+            cols.append(cards)
+        cols.sort()
+        max_len = max(len(col) for col in cols)
+        for ndx in range(max_len):
             row = ''
-            for col in sorted(state[5]):
-                if ndx * 2 < len(col):
-                    card = col[ndx*2:ndx*2+2]
+            for col in cols:
+                if ndx < len(col):
+                    card = col[ndx]
                 else:
                     card = '  '
                 row += card + '  '
-            print row
+            lines.append(row)
+
+        sys.stdout.write('\n'.join(lines) + '\n')
+
+    def solve_parallel(self, workers, max_closed=None):
+        """Return the list of moves found by the first of several A* searches to finish.
+
+        :param workers: the number of searches, each run in its own process
+        :type workers: integer
+        :param max_closed: the most expanded states each search remembers, or None for no limit
+        :type max_closed: integer
+
+        The first search breaks ties the same way astar does on its own; each
+        of the others breaks ties between equally good states in a different
+        random order, so they explore the states in different orders. The
+        other searches are stopped once one finds a solution.
+
+        This may raise a NoSolutionError if every search fails.
+        """
+        if workers < 1:
+            raise ValueError('Need at least one worker, not %s' % workers)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=_astar_moves, args=(self, max_closed, seed or None, results))
+            for seed in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for _ in processes:
+                moves = results.get()
+                if moves is not None:
+                    return moves
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+        raise NoSolutionError
 
 
 def heuristic(state):
-    """Return the heuristic."""
+    """Return the heuristic.
+
+    This is a lower bound on the number of moves left: every card that isn't
+    home needs at least one move, and a card buried above a lower card of the
+    same suit needs at least two.
+    """
     # Imagine you have an infinite number of free cells.
     #
     # The idea is this:
     #  For a card c in the tableau, it must go to a free cell if there is a card with
     #  the same suit deeper in the column with a lower rank.
-    rtn = len(state[4])
-    for col in state[5]:
-        min_cards = {suit: _MAX_RANK for suit in ['S', 'C', 'D', 'H']}
-        for ndx in xrange(0, len(col), 2):
-            rank = Card.get_rank_int(col[ndx])
-            suit = col[ndx+1]
-            if min_cards[suit] < rank:
-                rtn += 2
-            else:
-                rtn += 1
-                min_cards[suit] = rank
+    return len(state[1]) + sum(map(_column_heuristic, state[2]))
+
+
+@lru_cache(maxsize=1 << 16)
+def _column_heuristic(col):
+    """Return the moves the heuristic counts for the cards in this column.
+
+    :param col: a column
+    :type col: int
+
+    Most moves change only one column, so the same columns show up in many
+    states; the result is cached.
+    """
+    rtn = 0
+    min_cards = [_MAX_RANK] * 4
+    # Walk the column from its deepest card to its playable card.
+    for shift in range((col.bit_length() - 1) // _CARD_BITS * _CARD_BITS, -1, -_CARD_BITS):
+        card = (col >> shift) & _CARD_MASK
+        rank = card >> 2
+        suit = card & 3
+        if min_cards[suit] < rank:
+            rtn += 2
+        else:
+            rtn += 1
+            min_cards[suit] = rank
+    return rtn
+
+
+def _astar_moves(problem, max_closed, seed, results):
+    """Put the list of moves A* finds for this problem on the results queue.
+
+    :param results: the queue to put the moves on
+    :type results: multiprocessing.Queue
+
+    This runs in a worker process for FreeCellProblem.solve_parallel. It puts
+    None if the search fails, so one failed search doesn't stop the others
+    and the parent never waits on a worker that won't report.
+    """
+    moves = None
+    try:
+        moves = list(astar(problem, heuristic, max_closed, seed))
+    except NoSolutionError:
+        pass
+    finally:
+        results.put(moves)
+
+
+def _positive_int(text):
+    """Return this command line argument as an integer, which must be at least 1."""
+    rtn = int(text)
+    if rtn < 1:
+        raise argparse.ArgumentTypeError('must be at least 1, not %s' % text)
     return rtn
 
 
@@ -680,13 +817,27 @@ is the top of the column and can be moved. Example (you'll have more cards than
 TD,JC,2H
 """
     parser.add_argument('filename', help=help_text)
+    parser.add_argument(
+        '--max-closed', type=_positive_int, default=None,
+        help='Most expanded states to keep in the closed set; older ones may be expanded again. '
+        'The parent and g score of every state reached are still kept, so this does not bound '
+        'total memory (default: no limit)'
+    )
+    parser.add_argument(
+        '--workers', type=_positive_int, default=1,
+        help='Number of searches to run in parallel, each breaking ties differently; the first to finish wins (default: 1)'
+    )
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO, format='%(asctime)s: %(message)s')
     logging.info('Starting')
     problem = FreeCellProblem(args.filename)
-    for move in astar(problem, heuristic):
-        print move
+    if args.workers > 1:
+        moves = problem.solve_parallel(args.workers, args.max_closed)
+    else:
+        moves = astar(problem, heuristic, args.max_closed)
+    for move in moves:
+        print(move)
 
 
 if __name__ == '__main__':
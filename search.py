@@ -3,9 +3,11 @@
 See https://en.wikipedia.org/wiki/A*_search_algorithm
 """
 
-from collections import deque
+from collections import OrderedDict, deque
 from heapq import heappush, heappop
+from itertools import count
 import logging
+from random import Random
 from time import time
 
 _INFINITY = float('inf')
@@ -14,6 +16,10 @@ _INFINITY = float('inf')
 class _OpenSet(object):
     """An object for pushing on states and popping them off."""
 
+    # Whether a state pushed again replaces its parent. Only safe when the new
+    # parent is on a strictly cheaper path, so parent links can't form a cycle.
+    reparents = False
+
     def push(self, state, cost):
         """Put this state in this open set if possible.
 
@@ -51,7 +57,7 @@ class _Stack(_OpenSet):
 
     def pop(self):
         """Remove and return a state. Raise an IndexError if the stack is empty."""
-        self._stack.pop()
+        return self._stack.pop()
 
     def empty(self):
         """Return whether or not this stack is empty."""
@@ -68,15 +74,23 @@ class _Queue(_OpenSet):
     def __init__(self):
         """Initialize."""
         self._queue = deque()
+        self._seen = set() # States pushed so far
 
     def push(self, state, _):
-        """Put this state in this queue."""
+        """Put this state in this queue. Return whether or not it can push.
+
+        A state can only be pushed once; the first time it is reached is along
+        a shortest path.
+        """
+        if state in self._seen:
+            return False
+        self._seen.add(state)
         self._queue.append(state)
         return True
 
     def pop(self):
-        """Remove and return a state. Raise an IndexError if the stack is empty."""
-        self._queue.popleft()
+        """Remove and return a state. Raise an IndexError if the queue is empty."""
+        return self._queue.popleft()
 
     def empty(self):
         """Return whether or not this queue is empty."""
@@ -88,18 +102,32 @@ class _Queue(_OpenSet):
 
 
 class _PriorityQueue(_OpenSet):
-    """A priority queue that uses F score"""
+    """A priority queue that uses F score
+
+    Ties in F score go to the state with the higher G score (the one closer
+    to the goal), then to the state pushed first (or in a random order, if
+    seeded).
+    """
+
+    reparents = True # A state is only pushed again along a cheaper path
 
-    def __init__(self, heuristic):
+    def __init__(self, heuristic, seed=None):
         """Initialize.
 
         :param heuristic: the heuristic function that maps a state to an integer
         :type heuristic: function
+        :param seed: if not None, break the remaining ties in a random order from this seed
+        :type seed: integer
         """
         self._heuristic = heuristic
         self._heap = []
         self._g_score = {}
+        self._h_score = {} # Heuristic of each state in the heap, so a state pushed again isn't re-scored
         self._last_g_score = None # g score of the last state returned from pop
+        if seed is None:
+            self._tie_break = count() # Breaks remaining ties without comparing states
+        else:
+            self._tie_break = iter(Random(seed).random, None)
 
     def push(self, state, cost):
         """Put this state in this priority queue. Return whether or not it can push.
@@ -117,14 +145,19 @@ class _PriorityQueue(_OpenSet):
                 return False
 
         self._g_score[state] = g_score
-        heappush(self._heap, (g_score + self._heuristic(state), state))
+        h_score = self._h_score.get(state)
+        if h_score is None:
+            h_score = self._h_score[state] = self._heuristic(state)
+        heappush(self._heap, (g_score + h_score, -g_score, next(self._tie_break), state))
         return True
 
 
     def pop(self):
         """Remove and return a state."""
-        rtn = heappop(self._heap)[1]
+        rtn = heappop(self._heap)[-1]
         self._last_g_score = self._g_score[rtn]
+        # Once popped, the state is expanded and won't be pushed again.
+        self._h_score.pop(rtn, None)
         return rtn
 
     def empty(self):
@@ -136,11 +169,43 @@ class _PriorityQueue(_OpenSet):
         return len(self._heap)
 
 
+class _BoundedSet(object):
+    """A set that forgets its oldest members once it holds too many."""
+
+    def __init__(self, max_size):
+        """Initialize.
+
+        :param max_size: the most members to keep
+        :type max_size: integer
+        """
+        self._members = OrderedDict()
+        self._max_size = max_size
+        self.evictions = 0 # Number of members forgotten so far
+
+    def add(self, item):
+        """Add this item, evicting the oldest member if the set is full."""
+        members = self._members
+        members[item] = None
+        if len(members) > self._max_size:
+            members.popitem(last=False)
+            self.evictions += 1
+
+    def __contains__(self, item):
+        """Return whether or not this item is in the set."""
+        return item in self._members
+
+    def __len__(self):
+        """Return the length."""
+        return len(self._members)
+
+
 class Problem(object):
     """Represents a problem.
 
     Subclass this with your own problem.
     """
+    __slots__ = ()
+
     def initial_state(self):
         """Return the initial state."""
         raise NotImplementedError
@@ -150,7 +215,7 @@ class Problem(object):
         raise NotImplementedError
 
     def neighbors(self, state):
-        """Return a list of (state, cost) tuples that can be reached from this state."""
+        """Return an iterable of (state, cost) tuples that can be reached from this state."""
         raise NotImplementedError
 
     def move_description(self, from_state, to_state):
@@ -184,62 +249,92 @@ def _reconstruct_path(current, came_from, problem):
     return reversed(rtn)
 
 
-def _search(problem, open_set):
+def _search(problem, open_set, max_closed=None):
     """Return a list of moves from the start node to the end node.
 
     :param problem: The problem
     :type problem: Problem
     :param open_set: The empty open set
     :type open_set: _OpenSet
+    :param max_closed: the most expanded states to remember, or None for no limit
+    :type max_closed: integer
+
+    Once more than max_closed states have been expanded, the oldest are
+    forgotten and may be expanded again. This only bounds the closed set: the
+    parent of every state reached is still kept, as is the open set's own
+    bookkeeping (e.g. A*'s g scores). A state keeps the first parent it was
+    reached from unless the open set reparents, so a forgotten state reached
+    again can't become a descendant of itself.
 
     This may raise a NoSolutionError.
     """
     logging.info('Starting search')
-    closed = set()
+    if max_closed is None:
+        closed = set()
+    else:
+        closed = _BoundedSet(max_closed)
     came_from = {}
-    open_set.push(problem.initial_state(), 0)
+    start = problem.initial_state()
+    open_set.push(start, 0)
+    reparents = open_set.reparents
+    # Local names for the methods called in the loop below
+    push = open_set.push
+    pop = open_set.pop
+    is_goal = problem.is_goal
+    neighbors = problem.neighbors
     last_time = int(time())
     while not open_set.empty():
         new_time = int(time())
         if new_time >= last_time + 10:
             logging.info('Open set size: %s' % len(open_set))
+            if max_closed is not None and closed.evictions:
+                logging.info('Closed set evictions: %s' % closed.evictions)
             last_time = new_time
-        current = open_set.pop()
-        if problem.is_goal(current):
+        current = pop()
+        if current in closed:
+            # Already expanded through a cheaper path; don't compute its neighbors again.
+            continue
+        if is_goal(current):
             logging.info('Found solution')
             return _reconstruct_path(current, came_from, problem)
         closed.add(current)
-        for neighbor, cost in problem.neighbors(current):
+        for neighbor, cost in neighbors(current):
             if neighbor in closed:
                 continue
-            if open_set.push(neighbor, cost):
+            if push(neighbor, cost) and (reparents or (neighbor not in came_from and neighbor != start)):
                 came_from[neighbor] = current
 
     raise NoSolutionError
 
 
-def astar(problem, heuristic):
+def astar(problem, heuristic, max_closed=None, seed=None):
     """Return a list of moves from the start node to the end node using A*.
 
     :param problem: The problem
     :type problem: Problem
     :param heuristic: the heuristic that takes in a state and returns an integer
     :type heuristic: function
+    :param max_closed: the most expanded states to remember, or None for no limit
+    :type max_closed: integer
+    :param seed: if not None, break ties between equally good states in a random order from this seed
+    :type seed: integer
 
     This may raise a NoSolutionError.
     """
-    return _search(problem, _PriorityQueue(heuristic))
+    return _search(problem, _PriorityQueue(heuristic, seed), max_closed)
 
 
-def dfs(problem):
+def dfs(problem, max_closed=None):
     """Return a list of moves from the start node to the end node using depth first search.
 
     :param problem: The problem
     :type problem: Problem
+    :param max_closed: the most expanded states to remember, or None for no limit
+    :type max_closed: integer
 
     This may raise a NoSolutionError.
     """
-    return _search(problem, _Stack())
+    return _search(problem, _Stack(), max_closed)
 
 
 def bfs(problem):
@@ -249,5 +344,8 @@ def bfs(problem):
     :type problem: Problem
 
     This may raise a NoSolutionError.
+
+    There is no max_closed here: the queue remembers every state it has pushed,
+    so forgetting expanded states would save nothing.
     """
     return _search(problem, _Queue())
\ No newline at end of file
@@ -1,6 +1,46 @@
+import argparse
+
 import pytest
 
-from freecell import Card, FreeCellProblem
+from freecell import Card, FreeCellProblem, heuristic, _positive_int, is_red, _is_red_int, _is_red_str, _CARD_STR, _CARD_TYPE, _NEEDED_TYPE, _NUM_TYPES
+from search import NoSolutionError, astar
+
+_CARDS = FreeCellProblem._deck()
+
+def _card(card_str):
+    """Return the packed card for this string (e.g. '3H')."""
+    return _CARDS[card_str]
+
+def _col(col_str):
+    """Return the packed column for this string of cards (e.g. '3H6C')."""
+    col = 0
+    for ndx in range(0, len(col_str), 2):
+        col = (col << 6) | _card(col_str[ndx:ndx+2])
+    return col
+
+def _cols(*col_strs):
+    """Return the tableau (sorted tuple of packed columns) for these column strings."""
+    return tuple(sorted(_col(col_str) for col_str in col_strs))
+
+def _needed_tab(needed):
+    """Return a needed tableau list from this dict of card type to columns."""
+    rtn = [()] * _NUM_TYPES
+    for card_type, cols in needed.items():
+        rtn[card_type] = tuple(cols)
+    return rtn
+
+def _home(*ranks):
+    """Return the packed home cells for these 4 ranks."""
+    rtn = 0
+    for suit, rank in enumerate(ranks):
+        rtn |= rank << (suit * 8)
+    return rtn
+
+class _StuckProblem(FreeCellProblem):
+    """A FreeCellProblem with no moves, so every search of it fails."""
+
+    def neighbors(self, state):
+        return []
 
 def test_card():
     """Test the Card class."""
@@ -14,6 +54,7 @@ def test_card():
     assert card.type == (1, False)
     assert card.next_type is None
     assert card.tup == (1, 2)
+    assert card.id == (1 << 2) | 2
 
     card = Card(5, 1)
     assert card.next_type == (4, False)
@@ -25,138 +66,218 @@ class TestFreeCellProblem:
     @staticmethod
     def _equal_no_order(lst1, lst2):
         """Return whether or not these lists are equal without regards to order."""
-        return isinstance(lst1, list) and isinstance(lst2, list) and set(lst1) == set(lst2)
+        return isinstance(lst1, list) and isinstance(lst2, list) and sorted(lst1) == sorted(lst2)
 
     def test_init(self):
         """Test the __init__ method."""
-        assert self.prob.initial_state() == (0, 0, 0, 0, frozenset([]), frozenset(['5S7D5DJHQC4H', '2H9SJS6HKSTCTS', 'KC5H2DAC8HQD9D', '2SAH2CQS4C7S', '4S8D3HTDTH8C3S', 'JC5CKHQH9H6C7H', 'ADKD8S6D6SAS', '3D4D3C7C9CJD']))
+        assert self.prob.initial_state() == (0, (), _cols('5S7D5DJHQC4H', '2H9SJS6HKSTCTS', 'KC5H2DAC8HQD9D', '2SAH2CQS4C7S', '4S8D3HTDTH8C3S', 'JC5CKHQH9H6C7H', 'ADKD8S6D6SAS', '3D4D3C7C9CJD'))
 
         with pytest.raises(ValueError):
             FreeCellProblem('bad_state.csv')
 
+    def test_init_bad_card(self, tmp_path):
+        """Test that __init__ rejects unknown and repeated cards."""
+        with open('init_state.csv') as file_obj:
+            rows = file_obj.read().splitlines()
+        with_bad_card = tmp_path / 'bad_card.csv'
+        with_bad_card.write_text('\n'.join(rows + ['1H']) + '\n')
+        with pytest.raises(ValueError, match='Invalid card: 1H'):
+            FreeCellProblem(str(with_bad_card))
+
+        with_duplicate = tmp_path / 'duplicate.csv'
+        with_duplicate.write_text('\n'.join(rows + ['3H']) + '\n')
+        with pytest.raises(ValueError, match='Duplicate card: 3H'):
+            FreeCellProblem(str(with_duplicate))
+
     def test_is_red(self):
-        assert self.prob._is_red('H')
-        assert self.prob._is_red(0)
+        assert is_red('H')
+        assert is_red(0)
+        assert not is_red(2)
+        assert _is_red_str('D')
+        assert not _is_red_str('S')
+        assert _is_red_int(1)
+        assert not _is_red_int(3)
 
     def test_card_tup(self):
-        assert self.prob._card_tup('3C') == (3, 2)
+        assert _card('3C') == (3 << 2) | 2
 
     def test_card_str(self):
-        assert self.prob._card_str((3, 2)) == '3C'
+        assert _CARD_STR[(3 << 2) | 2] == '3C'
 
     def test_is_goal(self):
-        state = (13, 13, 13, 13, frozenset(), frozenset())
+        state = (_home(13, 13, 13, 13), (), ())
         assert self.prob.is_goal(state)
-        state = (13, 13, 13, 12, frozenset(), frozenset())
+        state = (_home(13, 13, 13, 12), (), ())
         assert not self.prob.is_goal(state)
 
     def test_meeets_need(self):
-        assert self.prob._meets_need((3, 2), (3, False))
-        assert not self.prob._meets_need((3, 2), (4, False))
+        assert _NEEDED_TYPE[_card('4D')] == _CARD_TYPE[_card('3C')]
+        assert _NEEDED_TYPE[_card('4D')] != _CARD_TYPE[_card('3H')]
+        assert _NEEDED_TYPE[_card('AD')] is None
 
     def test_remove_card_from_col(self):
-        tab = frozenset(['3H6C', '4DKD'])
-        assert self.prob._remove_card_from_col(tab, '4DKD') == {'3H6C', '4D'}
-        tab = frozenset(['3H6C', '4D'])
-        assert self.prob._remove_card_from_col(tab, '4D') == {'3H6C'}
+        tab = _cols('3H6C', '4DKD')
+        assert self.prob._remove_card_from_col(tab, _col('4DKD')) == _cols('3H6C', '4D')
+        tab = _cols('3H6C', '4D')
+        assert self.prob._remove_card_from_col(tab, _col('4D')) == _cols('3H6C')
 
     def test_add_card_to_col(self):
-        tab = frozenset(['3H6C', '4DKD'])
-        assert self.prob._add_card_to_col(tab, '3H6C', '8S') == {'3H6C8S', '4DKD'}
+        tab = _cols('3H6C', '4DKD')
+        assert self.prob._add_card_to_col(tab, _col('3H6C'), _card('8S')) == _cols('3H6C8S', '4DKD')
 
     def test_add_card_to_new_col(self):
-        tab = frozenset(['3H6C'])
-        assert self.prob._add_card_to_new_col(tab, '8S') == {'3H6C', '8S'}
+        tab = _cols('3H6C')
+        assert self.prob._add_card_to_new_col(tab, _card('8S')) == _cols('3H6C', '8S')
 
     def test_add_card_to_free(self):
-        assert self.prob._add_card_to_free(frozenset(['8S']), '3D') == frozenset(['8S', '3D'])
+        assert self.prob._add_card_to_free((_card('8S'),), _card('3D')) == (_card('3D'), _card('8S'))
 
     def test_remove_card_from_free(self):
-        assert self.prob._remove_card_from_free(frozenset(['8S', '3D']), '3D') == frozenset(['8S'])
+        assert self.prob._remove_card_from_free((_card('3D'), _card('8S')), _card('3D')) == (_card('8S'),)
 
     def test_to_home(self):
-        needed_home = {(3, 2)}
-        state = (13, 13, 2, 13, frozenset(), frozenset())
-        assert self.prob._to_home(state, needed_home, (3, 2)) == (13, 13, 3, 13)
-        assert self.prob._to_home(state, needed_home, (4, 2)) is None
+        state = (_home(13, 13, 2, 13), (), ())
+        assert self.prob._to_home(state, _card('3C')) == _home(13, 13, 3, 13)
+        assert self.prob._to_home(state, _card('4C')) is None
+        state = (_home(0, 0, 0, 0), (), ())
+        assert self.prob._to_home(state, _card('AH')) == _home(0, 1, 0, 0)
+        assert self.prob._to_home(state, _card('2H')) is None
 
     def test_remove_from_home(self):
-        state = (4, 8, 9, 0, frozenset(), frozenset())
-        assert self.prob._remove_from_home(state, (8, 1)) == (4, 7, 9, 0)
+        state = (_home(4, 8, 9, 0), (), ())
+        assert self.prob._remove_from_home(state, _card('8H')) == _home(4, 7, 9, 0)
 
     def test_to_tab(self):
-        tab = frozenset(['3H6C', '6S', 'TD'])
-        needed_tab = {
-            (5, True): ['3H6C', '6S'],
-            (9, False): ['TD']
-        }
-        result = self.prob._to_tab(tab, needed_tab, (5, 1))
-        assert isinstance(result, list) and set(result) == {
-            frozenset(['3H6C5H', '6S', 'TD']),
-            frozenset(['3H6C', '6S5H', 'TD']),
-            frozenset(['3H6C', '6S', 'TD', '5H'])
+        tab = _cols('3H6C', '6S', 'TD')
+        needed_tab = _needed_tab({
+            _CARD_TYPE[_card('5H')]: [_col('3H6C'), _col('6S')],
+            _CARD_TYPE[_card('9S')]: [_col('TD')]
+        })
+        result = list(self.prob._to_tab(tab, needed_tab, _card('5H')))
+        assert set(result) == {
+            _cols('3H6C5H', '6S', 'TD'),
+            _cols('3H6C', '6S5H', 'TD'),
+            _cols('3H6C', '6S', 'TD', '5H')
         }
 
 
-        tab = frozenset(['3H', 'AC', '7C', 'JD', '9S', '9D', 'KH', '7S'])
-        needed_tab = {
-            (2, False): ['3H'],
-            (6, True): ['7C', '7S'],
-            (10, False): ['JD'],
-            (8, True): ['9S'],
-            (8, False): ['9D'],
-            (12, False): ['KH']
-        }
-        assert self.prob._to_tab(tab, needed_tab, (2, 0)) == []
+        tab = _cols('3H', 'AC', '7C', 'JD', '9S', '9D', 'KH', '7S')
+        needed_tab = _needed_tab({
+            _CARD_TYPE[_card('2S')]: [_col('3H')],
+            _CARD_TYPE[_card('6H')]: [_col('7C'), _col('7S')],
+            _CARD_TYPE[_card('TS')]: [_col('JD')],
+            _CARD_TYPE[_card('8H')]: [_col('9S')],
+            _CARD_TYPE[_card('8S')]: [_col('9D')],
+            _CARD_TYPE[_card('QS')]: [_col('KH')]
+        })
+        assert list(self.prob._to_tab(tab, needed_tab, _card('2D'))) == []
 
     def test_card_type(self):
-        assert self.prob._card_type((5, 2)) == (5, False)
+        assert _CARD_TYPE[_card('5C')] == _CARD_TYPE[_card('5S')]
+        assert _CARD_TYPE[_card('5C')] != _CARD_TYPE[_card('5D')]
 
     def test_within_tab(self):
-        tab = frozenset(['3H6C', '6S'])
+        tab = _cols('3H6C', '6S')
         av_tab = self.prob._av_tab(tab)
         needed_tab = self.prob._needed_tab(av_tab)
-        assert self.prob._within_tab(tab, needed_tab, av_tab) == [frozenset(['3H', '6S', '6C'])]
+        assert list(self.prob._within_tab(tab, needed_tab, av_tab)) == [_cols('3H', '6S', '6C')]
 
-        tab = frozenset(['AC', 'AS', 'AD', 'AH', '3C', '3S', '3D', '3H'])
+        tab = _cols('AC', 'AS', 'AD', 'AH', '3C', '3S', '3D', '3H')
         av_tab = self.prob._av_tab(tab)
         needed_tab = self.prob._needed_tab(av_tab)
-        assert self.prob._within_tab(tab, needed_tab, av_tab) == []
+        assert list(self.prob._within_tab(tab, needed_tab, av_tab)) == []
 
-        tab = frozenset(['AC', 'AS', 'AD', 'AH', '3H6C', '7H', 'KD8C', 'JDTD'])
+        tab = _cols('AC', 'AS', 'AD', 'AH', '3H6C', '7H', 'KD8C', 'JDTD')
         av_tab = self.prob._av_tab(tab)
         needed_tab = self.prob._needed_tab(av_tab)
-        result = self.prob._within_tab(tab, needed_tab, av_tab)
-        assert isinstance(result, list) and set(result) == {
-            frozenset(['AC', 'AS', 'AD', 'AH', '3H', '7H6C', 'KD8C', 'JDTD']),
-            frozenset(['AC', 'AS', 'AD', 'AH', '3H6C', 'KD8C7H', 'JDTD'])
+        result = list(self.prob._within_tab(tab, needed_tab, av_tab))
+        assert set(result) == {
+            _cols('AC', 'AS', 'AD', 'AH', '3H', '7H6C', 'KD8C', 'JDTD'),
+            _cols('AC', 'AS', 'AD', 'AH', '3H6C', 'KD8C7H', 'JDTD')
         }
 
-    def test_new_state(self):
-        state = (3, 8, 10, 0, frozenset(['3H']), frozenset(['6C8C', '9S3C']))
-        assert self.prob._new_state(state) == state
-
-        assert self.prob._new_state(state, free=frozenset()) == \
-         (3, 8, 10, 0, frozenset(), frozenset(['6C8C', '9S3C']))
-
     def test_av_home(self):
-        state = (3, 8, 10, 0, frozenset(), frozenset())
-        assert self.prob._av_home(state) == {(3, 0), (8, 1), (10, 2)}
-
-    def test_needed_home(self):
-        state = (3, 8, 13, 0, frozenset(), frozenset())
-        assert self.prob._needed_home(state) == {(4, 0), (9, 1), (1, 3)}
+        state = (_home(3, 8, 10, 0), (), ())
+        assert self.prob._av_home(state) == [_card('3D'), _card('8H'), _card('TC')]
 
     def test_av_tab(self):
-        tab = frozenset(['3H6C', '6S'])
-        assert self.prob._av_tab(tab) == {(6, 2): '3H6C', (6, 3): '6S'}
+        tab = _cols('3H6C', '6S')
+        assert self.prob._av_tab(tab) == {_card('6C'): _col('3H6C'), _card('6S'): _col('6S')}
 
     def test_needed_tab(self):
-        av_tab = {(1, 1): '4HAH', (9, 2): '4D9C', (13, 0): 'KD', (13, 1): 'KH'}
+        av_tab = {_card('AH'): _col('4HAH'), _card('9C'): _col('4D9C'), _card('KD'): _col('KD'), _card('KH'): _col('KH')}
         result = self.prob._needed_tab(av_tab)
-        assert isinstance(result, dict)
-        assert set(result) == {(8, True), (12, False)}
-        assert result[(8, True)] == ['4D9C']
-        assert self._equal_no_order(result[(12, False)], ['KD', 'KH'])
+        assert isinstance(result, list)
+        assert len(result) == _NUM_TYPES
+        assert {card_type for card_type, cols in enumerate(result) if cols} == {_CARD_TYPE[_card('8H')], _CARD_TYPE[_card('QS')]}
+        assert result[_CARD_TYPE[_card('8H')]] == (_col('4D9C'),)
+        assert self._equal_no_order(list(result[_CARD_TYPE[_card('QS')]]), [_col('KD'), _col('KH')])
+
+    def test_automatic_cards(self):
+        cards = [_card('AD'), _card('2H'), _card('3C'), _card('6H'), _card('6S')]
+        home = _home(0, 1, 2, 0)
+        assert self.prob._automatic_cards(home, cards) == {_card('AD'), _card('2H')}
+        # 3C needs 2D and 2H home
+        home = _home(2, 2, 2, 0)
+        assert self.prob._automatic_cards(home, cards) == {_card('3C')}
+        # 6H needs 5C, 5S, and 4D home
+        home = _home(4, 5, 5, 5)
+        assert self.prob._automatic_cards(home, cards) == {_card('6H')}
+        home = _home(5, 5, 5, 5)
+        assert self.prob._automatic_cards(home, cards) == {_card('6H'), _card('6S')}
+        home = _home(3, 5, 5, 5)
+        assert self.prob._automatic_cards(home, cards) == set()
+        home = _home(4, 5, 4, 5)
+        assert self.prob._automatic_cards(home, cards) == set()
+
+    def test_auto_neighbor(self):
+        state = (0, (_card('AD'),), _cols('KS2D', '9SAH', '3C'))
+        free = set(state[1])
+        av_tab = self.prob._av_tab(state[2])
+        assert self.prob._auto_neighbor(state, free, av_tab) == ((_home(2, 1, 0, 0), (), _cols('KS', '9S', '3C')), 3)
+
+        state = (0, (), _cols('KS2D', '9S3H'))
+        assert self.prob._auto_neighbor(state, set(), self.prob._av_tab(state[2])) is None
+
+    def test_move_description(self):
+        from_state = (0, (), _cols('KC9D', '3H6C', '7H'))
+        to_state = (0, (), _cols('KC9D', '3H', '7H6C'))
+        assert self.prob.move_description(from_state, to_state) == 'Move 6C on top of 7H.'
+
+        from_state = (0, (), _cols('KCQH', '7H'))
+        to_state = (0, (), _cols('KC', 'QH', '7H'))
+        assert self.prob.move_description(from_state, to_state) == 'Move QH to a new column.'
+
+        to_state = (0, (_card('QH'),), _cols('KC', '7H'))
+        assert self.prob.move_description(from_state, to_state) == 'Move QH to a free cell.'
+
+    def test_heuristic(self):
+        assert heuristic(self.prob.initial_state()) == 71
+        # 4H is above the lower 3H, so it counts 2; every other card counts 1.
+        assert heuristic((0, (_card('AD'),), _cols('3H5C4H', 'KS'))) == 6
+        assert heuristic((_home(13, 13, 13, 13), (), ())) == 0
+
+    def test_solve_parallel(self, tmp_path):
+        """Test solve_parallel on an easy layout, many times, and with failing searches."""
+        # Every suit in order except one column of each, which must be moved aside.
+        easy = tmp_path / 'easy.csv'
+        easy.write_text('\n'.join(
+            [','.join(rank + suit for rank in 'A234567') for suit in 'DHCS'] +
+            [','.join(rank + suit for rank in 'KQJT98') for suit in 'DHCS']
+        ) + '\n')
+        prob = FreeCellProblem(str(easy))
+        assert prob.solve_parallel(1) == list(astar(prob, heuristic))
+        for _ in range(30):
+            moves = prob.solve_parallel(3)
+            assert moves and all(move.startswith('Move ') for move in moves)
+
+        with pytest.raises(NoSolutionError):
+            _StuckProblem('init_state.csv').solve_parallel(3)
 
+        with pytest.raises(ValueError):
+            self.prob.solve_parallel(0)
 
+    def test_positive_int(self):
+        assert _positive_int('2') == 2
+        with pytest.raises(argparse.ArgumentTypeError):
+            _positive_int('0')
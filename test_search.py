@@ -0,0 +1,68 @@
+from search import Problem, astar, bfs, dfs, _BoundedSet
+
+
+class _GraphProblem(Problem):
+    """A problem on a small directed graph of integer states, starting at 0."""
+
+    def __init__(self, graph, goal):
+        """Initialize.
+
+        :param graph: maps a state to the list of states it leads to
+        :type graph: dict
+        :param goal: the goal state
+        :type goal: integer
+        """
+        self._graph = graph
+        self._goal = goal
+
+    def initial_state(self):
+        return 0
+
+    def is_goal(self, state):
+        return state == self._goal
+
+    def neighbors(self, state):
+        return [(neighbor, 1) for neighbor in self._graph[state]]
+
+    def move_description(self, from_state, to_state):
+        return '%s -> %s' % (from_state, to_state)
+
+
+def test_bounded_set():
+    """Test that _BoundedSet forgets its oldest members first and counts them."""
+    members = _BoundedSet(2)
+    for item in (1, 2, 3):
+        members.add(item)
+    assert 1 not in members and 2 in members and 3 in members
+    assert len(members) == 2
+    assert members.evictions == 1
+
+    members.add(4)
+    assert 2 not in members and 3 in members and 4 in members
+    assert members.evictions == 2
+
+
+def test_astar_max_closed():
+    """Test that A* still finds the shortest path when it forgets expanded states."""
+    problem = _GraphProblem({0: [1, 2], 1: [0, 4], 2: [3], 3: [0], 4: [5], 5: []}, 5)
+    assert list(astar(problem, lambda state: 0, max_closed=1)) == ['0 -> 1', '1 -> 4', '4 -> 5']
+
+
+def test_dfs_max_closed():
+    """Test that a forgotten state reached again doesn't put a cycle in the path."""
+    # With max_closed=1, 0 is forgotten when 1 is expanded and reached again from 1.
+    problem = _GraphProblem({0: [2, 1], 1: [0, 2], 2: [3], 3: []}, 3)
+    assert list(dfs(problem, max_closed=1)) == ['0 -> 2', '2 -> 3']
+
+
+def test_dfs():
+    """Test that dfs follows the states it pops to the goal."""
+    problem = _GraphProblem({0: [1], 1: [0, 2], 2: []}, 2)
+    assert list(dfs(problem)) == ['0 -> 1', '1 -> 2']
+
+
+def test_bfs():
+    """Test that bfs keeps the shortest path when a longer one reaches the goal later."""
+    # 3 is pushed first from 1, then again from 4 before it is popped.
+    problem = _GraphProblem({0: [2, 1], 1: [3], 2: [4], 3: [], 4: [3]}, 3)
+    assert list(bfs(problem)) == ['0 -> 1', '1 -> 3']